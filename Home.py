@@ -1,11 +1,4 @@
-import pandas as pd
-from modules.upload import render_upload_page
-from modules.sce3 import week_analysis
-from modules.sce2 import month_analysis 
-from modules.sce4 import duration_month_analysis
-from modules.sce5 import duration_week_analysis
-from modules.step1 import uploadstep1_page
-from modules.sce2_capacity import month_capacity_analysis 
+import importlib
 import streamlit as st 
 #Streamlit 
 st.set_page_config(
@@ -14,21 +7,19 @@ st.set_page_config(
     layout="wide" 
 )
 
+# session_state.page -> (module, page function); a page's module is only imported when it is first shown
+PAGES = {
+    "Upload": ("modules.upload", "render_upload_page"),
+    "step1": ("modules.step1", "uploadstep1_page"),
+    "sce2": ("modules.sce2", "month_analysis"),
+    "sce3": ("modules.sce3", "week_analysis"),
+    "sce4": ("modules.sce4", "duration_month_analysis"),
+    "sce5": ("modules.sce5", "duration_week_analysis"),
+    "sce2_capacity": ("modules.sce2_capacity", "month_capacity_analysis"),
+}
 
-if "page" not in st.session_state:
-    st.session_state.page = "Upload"
-if st.session_state.page == "Upload":
-    render_upload_page()
-elif st.session_state.page== "step1":
-    uploadstep1_page()
+st.session_state.setdefault("page", "Upload")
 # if session_state.page == "Upload", we will run the function "render_upload_page()"
-elif st.session_state.page == "sce2":
-    month_analysis()
-elif st.session_state.page == "sce3":
-    week_analysis()
-elif st.session_state.page == "sce4":
-    duration_month_analysis()
-elif st.session_state.page == "sce5":
-    duration_week_analysis()
-elif st.session_state.page == "sce2_capacity":
-    month_capacity_analysis()
+if st.session_state.page in PAGES:
+    module_name, page_name = PAGES[st.session_state.page]
+    getattr(importlib.import_module(module_name), page_name)()
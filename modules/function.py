@@ -1,369 +1,373 @@
 import polars as pl
-import seaborn as sns
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
+from datetime import date, datetime
 import streamlit as st
-import plotly.express as px
 import io
 import re
-import matplotlib
+import hashlib
 import pandas as pd
+import numpy as np
 _WEEKS_LIST     = ['Week 1', 'Week 2', 'Week 3', 'Week 4', 'Week 5']
 _WEEKDAY_ORDER = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+_WEEKDAY_ENUM = pl.Enum(_WEEKDAY_ORDER)
+_WEEK_ENUM = pl.Enum(_WEEKS_LIST)
+_MONTH_ABBR = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+# Shift labels in the capacity schedule
+_AMPM_INTERVAL = re.compile(r'^(\d{1,2})(?::(\d{2}))?([ap])-(\d{1,2})(?::(\d{2}))?([ap])', re.IGNORECASE)
+_24H_INTERVAL = re.compile(r'^(\d{2}):?(\d{2})-(\d{2}):?(\d{2})')
+
+def _weekday_enum(date: pl.Expr) -> pl.Expr:
+    """Weekday of a date expression as _WEEKDAY_ENUM, which groups on integer codes and sorts Sunday..Saturday."""
+    # dt.weekday() is Monday=1..Sunday=7; mod 7 gives the enum's Sunday=0 physical order
+    return (date.dt.weekday() % 7).cast(pl.UInt32).cast(_WEEKDAY_ENUM)
+
+def _frame_hash(df: pl.DataFrame) -> str:
+    """Full content hash of a frame: schema plus every row. Computed once per upload and kept as 'crna_key'."""
+    h = hashlib.sha1(str(df.schema).encode())
+    h.update(df.hash_rows(seed=0).to_numpy().tobytes())
+    return h.hexdigest()
+
+# The upload-sized frames below are keyed on the upload's content hash ('crna_key' in session_state),
+# passed alongside them; the frame itself is '_df' so Streamlit does not hash it on every rerun
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _prepare_crna_data(_df, key: str) -> pl.DataFrame:
+    """Parse the uploaded table's Date column and add 'weekday'; shared read-only by every page."""
+    df = pl.from_pandas(_df) if isinstance(_df, pd.DataFrame) else _df
+
+    if df.schema['Date'] == pl.String:
+        df = df.with_columns([
+            # First standardize the format by replacing all separators with '/'
+            pl.col('Date').str.replace_all(r'[-.]', '/').alias('Date')
+        ]).with_columns([
+            # Then try both date formats with strict=False
+            pl.coalesce([
+                pl.col('Date').str.strptime(pl.Date, format='%Y/%m/%d', strict=False),
+                pl.col('Date').str.strptime(pl.Date, format='%m/%d/%Y', strict=False)
+            ]).alias('Date')
+        ])
+    elif df.schema['Date'] != pl.Date:
+        df = df.with_columns(pl.col('Date').cast(pl.Date))
 
-@st.cache_data(show_spinner=False)
-def _parse_time_series(df: pl.DataFrame) -> pl.DataFrame:
-    """Parse time series data and handle edge cases."""
-    # Drop rows with null values in In Room or Out Room
-    temp = df.filter(
-        ~pl.col('In Room').is_null() & 
-        ~pl.col('Out Room').is_null()
-    )
-    
-
-    temp = temp.with_columns([
-        (pl.col('Date').cast(str) + ' ' + pl.col('In Room')).alias('In_str'),
-        (pl.col('Date').cast(str) + ' ' + pl.col('Out Room')).alias('Out_str')
-    ])
-    
-    # Then convert to datetime by adding reference date
-    temp = temp.with_columns([
-        pl.col('In_str').str.strptime(pl.Datetime, format='%Y-%m-%d %H:%M').alias('In_dt'),
-        pl.col('Out_str').str.strptime(pl.Datetime, format='%Y-%m-%d %H:%M').alias('Out_dt')
+    df = df.with_columns([
+        _weekday_enum(pl.col('Date')).alias('weekday')
     ])
-    
-    # Handle cross-day cases
-    temp = temp.with_columns([
-        pl.when(pl.col('Out_dt') < pl.col('In_dt'))
-            .then(pl.col('Out_dt') + timedelta(days=1))
-            .otherwise(pl.col('Out_dt'))
-            .alias('Out_dt')
-    ])
-    return temp
-
-@st.cache_data(show_spinner=False)
-def _compute_presence_matrix(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.to_pandas()
-    df = df.copy()
-    df['In_dt'] = pd.to_datetime(df['Date'].astype(str) + ' ' + df['In Room'])
-    df['Out_dt'] = pd.to_datetime(df['Date'].astype(str) + ' ' + df['Out Room'])
-    df.loc[df['Out_dt'] <= df['In_dt'], 'Out_dt'] += pd.Timedelta(days=1)
-
-    def hour_range(row):
-        start = row['In_dt'].replace(minute=0, second=0, microsecond=0)
-        end = row['Out_dt']
-        hours = []
-        cur = start
-        while cur < end:
-            hours.append(cur)
-            cur += timedelta(hours=1)
-        return hours
-
-    df['hour_ts'] = df.apply(hour_range, axis=1)
-    df_exploded = df.explode('hour_ts')
-
-    df_exploded['Date'] = df_exploded['hour_ts'].dt.date
-    df_exploded['hour'] = df_exploded['hour_ts'].dt.hour
-
-    result = (
-        df_exploded
-        .groupby(['Date', 'hour'], as_index=False)['Count']
-        .sum()
-        .pivot(index='Date', columns='hour', values='Count')
-        .fillna(0)
-        .astype(float)
+    return df
+
+def _stay_seconds(df: pl.DataFrame):
+    """Return each row's Date, its In/Out offsets in seconds from that Date's midnight, and its Count."""
+    # Seconds since midnight straight from the parsed clock time, no datetimes built
+    def clock_seconds(col):
+        return pl.col(col).str.strptime(pl.Time, format='%H:%M').cast(pl.Int64) // 1_000_000_000
+
+    stays = (
+        df.lazy()
+        # Drop rows with null values in In Room or Out Room
+        .filter(pl.col('In Room').is_not_null() & pl.col('Out Room').is_not_null())
+        .select([
+            pl.col('Date').cast(pl.Date),
+            clock_seconds('In Room').alias('in_sec'),
+            clock_seconds('Out Room').alias('out_sec'),
+            pl.col('Count')
+        ])
+        .collect()
+    )
+    in_sec = stays.get_column('in_sec').to_numpy()
+    out_sec = stays.get_column('out_sec').to_numpy()
+    # A stay ending at or before its start ends the next day; add the day arithmetically
+    out_sec = out_sec + 86400 * (out_sec <= in_sec)
+    return (
+        stays.get_column('Date').to_numpy(),
+        in_sec,
+        out_sec,
+        stays.get_column('Count').to_numpy().astype(np.float64)
     )
 
-    for h in range(24):
-        if h not in result.columns:
-            result[h] = 0.0
-    result = result[[col for col in ['Date'] + list(range(24)) if col in result.columns]]
-    result = result.sort_index(axis=1)
-
-    result['weekday'] = pd.to_datetime(result.index).strftime('%A')
-    print(result)
-
-    return pl.from_pandas(result.reset_index())
+def _weekday_codes(days: np.ndarray) -> np.ndarray:
+    """Weekday of each datetime64[D] as an int8 index into _WEEKDAY_ORDER (Sunday=0)."""
+    # 1970-01-01 was a Thursday
+    return ((days.astype(np.int64) + 4) % 7).astype(np.int8)
+
+def _hour_bin_frame(first_day: np.datetime64, mat: np.ndarray, hit: np.ndarray) -> pl.DataFrame:
+    """Wrap a (days, 24) matrix as Date, '0'..'23', weekday rows, keeping only the days in hit."""
+    dates = (first_day + np.arange(len(mat)))[hit]
+    # One copy into hour-major order, so each hour column is a contiguous slice Polars can take as is
+    by_hour = np.ascontiguousarray(mat[hit].T)
+    return pl.DataFrame({
+        'Date': dates,
+        **{str(h): by_hour[h] for h in range(24)},
+        'weekday': pl.Series(_weekday_codes(dates)).cast(pl.UInt32).cast(_WEEKDAY_ENUM)
+    })
 
-@st.cache_data(show_spinner=False)
-def _compute_monthly_summary(df: pl.DataFrame) -> pl.DataFrame:
+def _sweep_hour_bins(day, in_sec, out_sec, counts, duration: bool) -> pl.DataFrame:
+    """Difference-array sweep of every stay over a days x 24 hour timeline, O(N + days * 24)."""
+    first_day = day.min()
+    day_idx = (day - first_day).astype(np.int64)
+    n_days = int(day_idx.max()) + 2
+    size = n_days * 24 + 1
+
+    # Each stay covers the hour bins [first, last) counted from first_day's midnight
+    first = day_idx * 24 + in_sec // 3600
+    last = day_idx * 24 + (out_sec - 1) // 3600 + 1
+
+    # +Count where a stay enters, -Count where it leaves; the running sum is the per-hour total
+    mat = np.cumsum(np.bincount(first, counts, size) - np.bincount(last, counts, size))[:-1]
+    if duration:
+        # Take off the parts of the first and last hour the stay does not fill
+        mat -= np.bincount(first, counts * (in_sec % 3600) / 3600.0, size)[:-1]
+        mat -= np.bincount(last - 1, counts * (-out_sec % 3600) / 3600.0, size)[:-1]
+
+    # Only dates that some stay actually overlaps get a row
+    covered = np.cumsum(np.bincount(first, minlength=size) - np.bincount(last, minlength=size))[:-1]
+    hit = covered.reshape(n_days, 24).any(axis=1)
+
+    return _hour_bin_frame(first_day, mat.reshape(n_days, 24), hit)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _compute_presence_matrix(_df: pl.DataFrame, key: str) -> pl.DataFrame:
+    day, in_sec, out_sec, counts = _stay_seconds(_df)
+    return _sweep_hour_bins(day, in_sec, out_sec, counts, duration=False)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _compute_monthly_summary(_df: pl.DataFrame, key: str) -> pl.DataFrame:
     """Summarize number of records by 'Month' (Period) and generate 'MonthLabel'."""
     monthly_summary = (
-        df.with_columns([
-            pl.col('Date').dt.strftime('%Y-%m').alias('Month'),
-            pl.col('Date').dt.strftime('%b %y').alias('MonthLabel')
-        ])
-        .group_by(['Month', 'MonthLabel'])
-        .agg([
-            pl.count().alias('Count')
-        ])
+        _df.lazy()
+        .group_by(pl.col('Date').dt.truncate('1mo').alias('Month'))
+        .agg(pl.len().cast(pl.UInt32).alias('Count'))
         .sort('Month')
+        # Labels are built per month rather than per row, from a 12-entry lookup
+        .select([
+            pl.col('Month').dt.strftime('%Y-%m'),
+            (
+                pl.col('Month').dt.month().replace_strict(range(1, 13), _MONTH_ABBR, return_dtype=pl.String)
+                + ' '
+                + (pl.col('Month').dt.year() % 100).cast(pl.String).str.zfill(2)
+            ).alias('MonthLabel'),
+            'Count'
+        ])
+        .collect()
     )
     
     return monthly_summary
 
+def _weekday_day_counts(start_date: date, end_date: date) -> pl.DataFrame:
+    """Number of times each weekday occurs between start_date and end_date, inclusive."""
+    start = np.datetime64(start_date, 'D')
+    n_days = max(int((np.datetime64(end_date, 'D') - start).astype(np.int64)) + 1, 0)
+    # Every weekday occurs once per full week; the leftover days run on from start's weekday
+    counts = np.full(7, n_days // 7)
+    counts[(_weekday_codes(start) + np.arange(n_days % 7)) % 7] += 1
+    return pl.DataFrame({'weekday': pl.Series(_WEEKDAY_ORDER, dtype=_WEEKDAY_ENUM), 'count': counts})
+
 @st.cache_data(show_spinner=False)
-def _weekday_total_summary(df_with_time: pl.DataFrame, start_date: str, end_date: str) -> pl.DataFrame:
+def _weekday_hour_sums(df_with_time: pl.DataFrame):
+    """
+    Sum an hour matrix by weekday into a (7, 24) array, rows in _WEEKDAY_ORDER, and count
+    the distinct dates behind each row. Shared by the weekday totals and the heatmap.
+    """
     hour_cols = [str(h) for h in range(24)]
-    result = (
-        df_with_time
-        .group_by('weekday')
-        .agg([
-            pl.col(col).sum().alias(col) for col in hour_cols
-        ])
-        .filter(pl.col('weekday').is_in(_WEEKDAY_ORDER))
-        .sort('weekday')
-    )
-    start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-    end_dt = datetime.strptime(end_date, '%Y-%m-%d')
-    date_list = []
-    cur = start_dt
-    while cur <= end_dt:
-        date_list.append(cur)
-        cur += timedelta(days=1)
-    day_counts = (
-        pl.DataFrame({'date': date_list})
-        .with_columns([
-            pl.col('date').dt.strftime('%A').alias('weekday')
-        ])
-        .group_by('weekday')
-        .count()
-        .filter(pl.col('weekday').is_in(_WEEKDAY_ORDER))
-        .sort('weekday')
-    )
-    result = result.with_columns(
-        (pl.sum_horizontal(hour_cols) / 24 / day_counts.get_column('count')).alias('Total')
+    int_cols = [h for h in range(24) if h in df_with_time.columns]
+    if int_cols:
+        df_with_time = df_with_time.rename({h: str(h) for h in int_cols})
+
+    days = df_with_time.get_column('Date').to_numpy()
+    raw = np.zeros((7, 24))
+    np.add.at(raw, _weekday_codes(days), df_with_time.select(hour_cols).to_numpy())
+    dates_seen = np.bincount(_weekday_codes(np.unique(days)), minlength=7)
+    return raw, dates_seen
+
+def _weekday_totals(df_with_time: pl.DataFrame, start_date: date, end_date: date) -> pl.LazyFrame:
+    """
+    Summed hours per weekday over 24, joined with that weekday's count in the range.
+    All seven weekdays come out Sunday..Saturday; one absent from the data has a null Total.
+    """
+    raw, dates_seen = _weekday_hour_sums(df_with_time)
+    sums = pl.DataFrame({
+        'weekday': pl.Series(_WEEKDAY_ORDER, dtype=_WEEKDAY_ENUM),
+        'hours': raw.sum(axis=1),
+        'present': dates_seen > 0
+    })
+    return (
+        sums.lazy()
+        .join(_weekday_day_counts(start_date, end_date).lazy(), on='weekday', how='left')
+        .with_columns(
+            pl.when(pl.col('present')).then(pl.col('hours') / (pl.col('count') * 24)).alias('Total')
+        )
     )
-    return result.select(['weekday', 'Total'])
 
 @st.cache_data(show_spinner=False)
-def _compute_normalized_heatmap(df_with_time: pl.DataFrame, start_date: str, end_date: str) -> pl.DataFrame:
+def _weekday_total_summary(df_with_time: pl.DataFrame, start_date: date, end_date: date) -> pl.DataFrame:
+    return _weekday_totals(df_with_time, start_date, end_date).select(['weekday', 'Total']).collect()
+
+@st.cache_data(show_spinner=False)
+def _compute_normalized_heatmap(df_with_time: pl.DataFrame, start_date: date, end_date: date) -> pl.DataFrame:
     """
     1. Sum by 'weekday' × 24 hours to get raw_counts (7×24).
     2. Count how many times each weekday occurs between start_date and end_date.
     3. Divide raw_counts by day_counts, round, and return an integer-format heatmap matrix.
     """
-    # Get all hour columns
     hour_cols = [str(h) for h in range(24)]
-    int_cols = [h for h in range(24) if h in df_with_time.columns]
-    if int_cols:
-        df_with_time = df_with_time.rename({h: str(h) for h in int_cols})
-    # Sum by weekday for each hour
-    raw = (
-        df_with_time
-        .group_by('weekday')
-        .agg([
-            pl.sum(col).alias(col) for col in hour_cols
-        ])
-        .filter(pl.col('weekday').is_in(_WEEKDAY_ORDER))
-        .sort('weekday')
-    )
-    
-    # Convert start/end to python datetime for robustness
-    start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-    end_dt   = datetime.strptime(end_date, '%Y-%m-%d')
-
-    date_list = []
-    cur = start_dt
-    while cur <= end_dt:
-        date_list.append(cur)
-        cur += timedelta(days=1)
-
-    all_dates = df_with_time.get_column('Date').unique().to_list()
-    date_df = pl.DataFrame({'date': all_dates})
-    date_df = date_df.with_columns([
-        pl.col('date').dt.strftime('%A').alias('weekday')
-    ])
-    day_counts = (
-        date_df
-        .group_by('weekday')
-        .count()
-        .filter(pl.col('weekday').is_in(_WEEKDAY_ORDER))
-        .sort('weekday')
-    )
-    all_weekdays = pl.DataFrame({'weekday': _WEEKDAY_ORDER})
+    raw, day_counts = _weekday_hour_sums(df_with_time)
 
-    raw = all_weekdays.join(raw, on='weekday', how='left').fill_null(0)
-    day_counts = all_weekdays.join(day_counts, on='weekday', how='left').fill_null(0)
-    
-    # Normalize the counts
-    normalized = raw.with_columns([
-        (pl.col(col) / day_counts.get_column('count'))
-            .fill_nan(0)
-            .clip(upper_bound=1.00)
-            .cast(pl.Float64)
-            .alias(col)
-        for col in hour_cols
-    ])
-    
-    return normalized.fill_null(0.0)
+    # Normalize the counts; a weekday with no dates stays at 0
+    normalized = np.divide(raw, day_counts[:, None], out=np.zeros_like(raw), where=day_counts[:, None] > 0)
+    normalized = np.minimum(normalized, 1.00)
+
+    return pl.DataFrame({
+        'weekday': pl.Series(_WEEKDAY_ORDER, dtype=_WEEKDAY_ENUM),
+        **{col: normalized[:, h] for h, col in enumerate(hour_cols)}
+    })
 
 @st.cache_data(show_spinner=False)
-def _weekday_total_summary_capacity(df_with_time: pl.DataFrame, start_date: str, end_date: str) -> pl.DataFrame:
+def _weekday_total_summary_capacity(df_with_time: pl.DataFrame, start_date: date, end_date: date) -> pl.DataFrame:
     """
     Groups by 'weekday', sums the hourly demand, and calculates the average
     daily demand based on the number of occurrences of each weekday within the
     specified date range.
     """
-    hour_cols = [str(h) for h in range(24)]
-    
-    # --- FIX: Robustly count weekdays in the specified date range ---
-    start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-    end_dt = datetime.strptime(end_date, '%Y-%m-%d')
-    
-    # Create a DataFrame of all dates in the range
-    all_dates_df = pl.DataFrame({
-        'date': pl.date_range(start_dt, end_dt, "1d", eager=True)
-    })
-    
-    # Get the weekday for each date
-    all_dates_df = all_dates_df.with_columns(
-        pl.col('date').dt.strftime('%A').alias('weekday')
-    )
-    
-    # Count occurrences of each weekday
-    day_counts = all_dates_df.group_by('weekday').count()
-    
-    # Ensure all weekdays are present and in the correct order
-    weekday_template = pl.DataFrame({
-        'weekday': _WEEKDAY_ORDER
-    })
-    
-    day_counts = weekday_template.join(
-        day_counts, on='weekday', how='left'
-    ).with_columns(
-        pl.col('count').fill_null(0) # Fill missing weekdays with 0 count
-    )
-    # --- End of FIX ---
-
-    # Group by weekday and sum the hourly columns
-    result = (
-        df_with_time
-        .group_by('weekday')
-        .agg([
-            pl.col(col).sum().alias(col) for col in hour_cols
-        ])
-        .filter(pl.col('weekday').is_in(_WEEKDAY_ORDER))
+    # A weekday that never occurs in the range has 0 / 0 demand; report it as 0
+    return (
+        _weekday_totals(df_with_time, start_date, end_date)
+        .select(['weekday', pl.col('Total').fill_nan(0)])
+        .collect()
     )
 
-    # Join with day_counts to get the correct divisor
-    result = result.join(day_counts, on='weekday', how='left')
+@st.cache_data(show_spinner=False)
+def _assign_month_week(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Add a 'week_of_month' column (Week 1 through Week 5) to a DataFrame that already has a 'Date' column.
+    """
+    # Only the hour-bin matrices come through here, and they always carry a parsed pl.Date
+    assert df.schema["Date"] == pl.Date, f"expected a pl.Date 'Date' column, got {df.schema['Date']}"
 
-    # Calculate Total as the sum of all hours, divided by 24 and the number of days
-    result = result.with_columns(
-        (pl.sum_horizontal(hour_cols) / 24 / pl.col('count')).fill_nan(0).alias('Total')
-    )
-    
-    return result.select(['weekday', 'Total'])
+    # Days 1-7 are Week 1, 8-14 Week 2, ...; 29-31 stay in Week 5. As an enum this is one integer op per row
+    return df.with_columns([
+        ((pl.col("Date").dt.day() - 1) // 7).clip(upper_bound=4).cast(pl.UInt32).cast(_WEEK_ENUM).alias("week_of_month")
+    ])
 
 @st.cache_data(show_spinner=False)
-def _compute_week_hm_data(df_with_time: pl.DataFrame, week_label: str) -> pl.DataFrame:
+def _compute_all_weeks_hm(df_with_time: pl.DataFrame) -> dict:
     """
-    Filter df_with_time by a given week_label ('Week 1'…'Week 5') and generate a 7×24 heatmap DataFrame:
-    1. Group by 'weekday' × hours 0–23 to get raw_counts;
-    2. If week_label is 'Week 5', fill NaN with 0;
-    3. Divide by 3, round, and convert to int.
-    Return a sorted DataFrame with index _WEEKDAY_ORDER and columns 0–23.
+    Generate the 7×24 heatmap DataFrame for every week_label ('Week 1'…'Week 5') at once:
+    1. Group by 'week_of_month' × 'weekday' × hours 0–23 to get raw_counts;
+    2. Divide each week by the number of months it spans, capped at 1.
+    Return {week_label: DataFrame sorted Sunday..Saturday with columns weekday, 0–23}.
     """
     # First ensure all hour columns exist with default 0
     hour_cols = [str(h) for h in range(24)]
-    for col in hour_cols:
-        if col not in df_with_time.columns:
-            df_with_time = df_with_time.with_columns(pl.lit(0).alias(col))
+    missing = [pl.lit(0).alias(col) for col in hour_cols if col not in df_with_time.columns]
 
-    # Filter by week and compute weekday
-    df_wk = (
+    lf = (
         df_with_time
-        .filter(pl.col("week_of_month") == week_label)
+        .lazy()
+        .with_columns(missing)
         .with_columns([
-            pl.col("Date").dt.strftime("%A").alias("weekday")
+            _weekday_enum(pl.col("Date")).alias("weekday")
         ])
     )
 
-    # Sum by weekday for each hour
-    agg = (
-        df_wk
-        .group_by("weekday")
-        .agg([
-            pl.col(col).sum().alias(col) for col in hour_cols
+    # One grouped pass for all weeks, plus the months each week spans, in one collect
+    agg, months = pl.collect_all([
+        lf
+        .group_by(["week_of_month", "weekday"])
+        .agg(pl.col(hour_cols).sum())
+        # Sort Sunday..Saturday on the enum's physical order, no Python callback per row
+        .sort("weekday"),
+        lf
+        .group_by("week_of_month")
+        .agg(pl.col("Date").cast(pl.Date).dt.truncate("1mo").n_unique().alias("month_count"))
+    ])
+
+    # Normalize by dividing by month_count
+    hm_data = (
+        agg.join(months, on="week_of_month")
+        .select([
+            "week_of_month",
+            "weekday",
+            (pl.col(hour_cols) / pl.col("month_count")).clip(upper_bound=1.00).cast(pl.Float64)
         ])
-        .filter(pl.col("weekday").is_in(_WEEKDAY_ORDER))
     )
-    
-    # Create a mapping for weekday order and sort manually
-    weekday_order_map = {day: i for i, day in enumerate(_WEEKDAY_ORDER)}
-    agg = agg.with_columns([
-        pl.col("weekday").map_elements(lambda x: weekday_order_map.get(x, 999), return_dtype=pl.Int32).alias("weekday_order")
-    ]).sort("weekday_order").drop("weekday_order")
 
-    if week_label == "Week 5":
-        agg = agg.fill_null(0)
+    by_week = hm_data.partition_by("week_of_month", as_dict=True, include_key=False)
+    empty = hm_data.clear().drop("week_of_month")
+    return {wk: by_week.get((wk,), empty) for wk in _WEEKS_LIST}
 
-    if 'Date' in df_wk.columns:
-        month_count = df_wk.get_column('Date').cast(pl.Date).dt.strftime('%Y-%m').n_unique()
-    else:
-        month_count = 1
-    if month_count == 0:
-        month_count = 1
+def _compute_week_hm_data(df_with_time: pl.DataFrame, week_label: str) -> pl.DataFrame:
+    """7×24 heatmap DataFrame for one week_label; see _compute_all_weeks_hm."""
+    return _compute_all_weeks_hm(df_with_time)[week_label]
 
-    # Normalize by dividing by month_count
-    hm_data = agg.with_columns([
-        (pl.col(col) / month_count).clip(upper_bound=1.00).cast(pl.Float64).alias(col) for col in hour_cols
-    ])
+@st.cache_data(show_spinner=False, max_entries=16)
+def _compute_duration_matrix(_df: pl.DataFrame, key: str) -> pl.DataFrame:
+    day, in_sec, out_sec, counts = _stay_seconds(_df)
+    return _sweep_hour_bins(day, in_sec, out_sec, counts, duration=True)
 
-    return hm_data
 
 @st.cache_data(show_spinner=False)
-def _compute_duration_matrix(df: pd.DataFrame) -> pl.DataFrame:
-    df = df.to_pandas()
-
-    df['In_dt'] = pd.to_datetime(df['Date'].astype(str) + ' ' + df['In Room'])
-    df['Out_dt'] = pd.to_datetime(df['Date'].astype(str) + ' ' + df['Out Room'])
-    df.loc[df['Out_dt'] <= df['In_dt'], 'Out_dt'] += pd.Timedelta(days=1)
-
-    def hour_range(row):
-        start = row['In_dt'].replace(minute=0, second=0, microsecond=0)
-        end = row['Out_dt']
-        hours = []
-        cur = start
-        while cur < end:
-            hours.append(cur)
-            cur += timedelta(hours=1)
-        return hours
-
-    df['hour_ts'] = df.apply(hour_range, axis=1)
-    df_exploded = df.explode('hour_ts')
-
-    df_exploded['Date'] = df_exploded['hour_ts'].dt.date
-    df_exploded['hour'] = df_exploded['hour_ts'].dt.hour
-
-    def calc_duration(row):
-        hour_start = row['hour_ts']
-        hour_end = hour_start + timedelta(hours=1)
-        overlap_start = max(row['In_dt'], hour_start)
-        overlap_end = min(row['Out_dt'], hour_end)
-        duration = (overlap_end - overlap_start).total_seconds() / 3600.0
-        return max(duration, 0) * row['Count']
-
-    df_exploded['duration'] = df_exploded.apply(calc_duration, axis=1)
-
-    result = (
-        df_exploded
-        .groupby(['Date', 'hour'], as_index=False)['duration']
-        .sum()
-        .pivot(index='Date', columns='hour', values='duration')
-        .fillna(0)
-    )
+def _hour_csv_bytes(hm_data: pl.DataFrame, header: str) -> bytes:
+    """Download CSV of a weekday x hour frame: one column of its values, Sunday 0h through Saturday 23h."""
+    values = hm_data.sort('weekday').select([str(h) for h in range(24)]).to_numpy().ravel()
+    return pl.DataFrame({header: values}).write_csv().encode("utf-8")
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _frame_csv_bytes(df: pl.DataFrame) -> bytes:
+    """Download CSV of a summary frame as is, so reruns with unchanged data skip the serialization."""
+    return df.write_csv().encode("utf-8")
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _figure_png(fig_json: str, scale: int = 2) -> bytes:
+    """PNG bytes for a Plotly figure passed as JSON, so an unchanged chart is only rendered by Kaleido once."""
+    import plotly.io as pio
 
-    for h in range(24):
-        if h not in result.columns:
-            result[h] = 0.0
-    result = result[[col for col in ['Date'] + list(range(24)) if col in result.columns]]
-    result = result.sort_index(axis=1)
+    return pio.to_image(pio.from_json(fig_json), format="png", scale=scale)
 
-    result['weekday'] = pd.to_datetime(result.index).strftime('%A')
 
-    return pl.from_pandas(result.reset_index())
+@st.cache_data(show_spinner=False, max_entries=32)
+def _week_heatmap_png(hm_data: pl.DataFrame, title: str, figsize: tuple = (20, 5), styled: bool = True) -> bytes:
+    """
+    PNG bytes of a week heatmap drawn with seaborn, so reruns with the same data and title skip matplotlib.
+    styled gives the on-page look (bold title, 'DOW' axis label); the all-weeks ZIP uses the plain one.
+    """
+    from matplotlib.figure import Figure
+    import seaborn as sns
+
+    # Hand seaborn a pandas frame over the hour values' NumPy block; no Arrow conversion of the enum column
+    hour_cols = [str(h) for h in range(24)]
+    grid = pd.DataFrame(
+        hm_data.select(hour_cols).to_numpy(),
+        index=pd.Index(hm_data.get_column('weekday').cast(pl.String).to_list(), name='weekday'),
+        columns=hour_cols
+    )
+    # A bare Agg-backed Figure, outside pyplot's global figure registry that sessions' threads would share
+    fig = Figure(figsize=figsize)
+    ax = fig.subplots()
+    sns.heatmap(grid, annot=True, fmt=".2f", linewidths=0.5, cmap='RdYlGn_r', ax=ax)
+    if styled:
+        ax.set_title(title, fontdict={'fontsize': 18, 'fontweight': 'bold'}, loc='center', pad=20)
+        ax.set_ylabel("DOW", fontsize=14)
+    else:
+        ax.set_title(title, loc='center')
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=150, bbox_inches="tight")
+    return buf.getvalue()
+
+def _parse_time_intervals(sheet: pd.Series) -> pd.DataFrame:
+    """Split shift labels like '3:30p-7a' or '0700-1530' into 'HH:MM' In/Out times ('' if unparseable)."""
+    s = sheet.astype(str).str.replace(' ', '', regex=False)
+    in_time = pd.Series('', index=s.index, dtype=object)
+    out_time = pd.Series('', index=s.index, dtype=object)
+
+    # 12-hour labels, e.g. 7a-3p or 3:30p-7a
+    ampm = s.str.extract(_AMPM_INTERVAL).dropna(subset=[0])
+    for target, (h, m, ap) in ((in_time, (0, 1, 2)), (out_time, (3, 4, 5))):
+        clock = ampm[h] + ':' + ampm[m].fillna('00') + ampm[ap] + 'm'
+        target[ampm.index] = pd.to_datetime(clock, format='%I:%M%p').dt.strftime('%H:%M')
+
+    # 24-hour labels, e.g. 0700-1530, for whatever the 12-hour pattern missed
+    hhmm = s.drop(ampm.index).str.extract(_24H_INTERVAL).dropna(subset=[0])
+    in_time[hhmm.index] = hhmm[0] + ':' + hhmm[1]
+    out_time[hhmm.index] = hhmm[2] + ':' + hhmm[3]
+    return pd.DataFrame({'In Time': in_time, 'Out Time': out_time})
 
 
 #Please read the README.md before you run the code
@@ -372,12 +376,22 @@ def process_schedule_excel(
     start_date_str='2025/01/01',
     end_date_str='2025/03/31',
 ):
+    # Key the cache on the file contents so reruns and re-uploads of the same file skip the work
+    if hasattr(excel_path, 'getvalue'):
+        # Streamlit UploadedFile / BytesIO: already in memory
+        file_bytes = excel_path.getvalue()
+    else:
+        with open(excel_path, 'rb') as f:
+            file_bytes = f.read()
+    return _process_schedule_cached(file_bytes, start_date_str, end_date_str)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _process_schedule_cached(file_bytes: bytes, start_date_str: str, end_date_str: str) -> pd.DataFrame:
     try:
             # FIX: Added header=None to correctly read CSV files
-            df = pd.read_csv(excel_path, header=None)
+            df = pd.read_csv(io.BytesIO(file_bytes), header=None)
     except Exception:
-            df = pd.read_excel(excel_path, header=None)
-    print(df)
+            df = pd.read_excel(io.BytesIO(file_bytes), header=None)
     df_raw = df.iloc[:, 0:49]
     rows_to_keep = [0, 1, -1]
     df_raw = df_raw.iloc[rows_to_keep]
@@ -407,27 +421,7 @@ def process_schedule_excel(
     df_result.fillna(0, inplace=True)
 
 
-    def parse_time_interval(s):
-        s = s.replace(' ', '')
-        match = re.match(r'(\d{1,2})(?::(\d{2}))?([ap])-(\d{1,2})(?::(\d{2}))?([ap])', s)
-        if match:
-            h1, m1, ap1, h2, m2, ap2 = match.groups()
-            m1 = m1 or '00'
-            m2 = m2 or '00'
-            t1 = f"{int(h1):02d}:{m1} {ap1}m"
-            t2 = f"{int(h2):02d}:{m2} {ap2}m"
-            t1 = pd.to_datetime(t1, format='%I:%M %p').strftime('%H:%M')
-            t2 = pd.to_datetime(t2, format='%I:%M %p').strftime('%H:%M')
-            return t1, t2
-
-        match = re.match(r'(\d{2}):?(\d{2})-(\d{2}):?(\d{2})', s)
-        if match:
-            h1, m1, h2, m2 = match.groups()
-            t1 = f"{h1}:{m1}"
-            t2 = f"{h2}:{m2}"
-            return t1, t2
-        return '', ''
-    df_result[['In Time', 'Out Time']] = df_result['Sheet'].apply(lambda x: pd.Series(parse_time_interval(str(x))))
+    df_result[['In Time', 'Out Time']] = _parse_time_intervals(df_result['Sheet'])
 
     df_result = df_result.drop(columns=['Sheet'])
 
@@ -448,48 +442,33 @@ def process_schedule_excel(
     end_date = datetime.strptime(end_date_str, '%Y/%m/%d')
     all_dates = pd.date_range(start=start_date, end=end_date, freq='D')
 
-    virtual_dates = {day: [] for day in weekday_cols}
-    for d in all_dates:
-        weekday = d.strftime('%A')
-        if weekday in virtual_dates:
-            virtual_dates[weekday].append(d.strftime('%Y/%m/%d'))
-
-
-    result = []
-    for _, row in df.iterrows():
-        for day in weekday_cols:
-            total_required = int(row[day])
-            if total_required == 0:
-                continue
-
-            available_dates = virtual_dates.get(day, [])
-            if not available_dates:
-                continue
-
-            n_available = len(available_dates)
-            
-            # --- Uniformly distribute the required count across available dates ---
-            # Base number of assignments for each available date
-            base_count = total_required // n_available
-            # Number of dates that will get one extra assignment
-            remainder = total_required % n_available
-
-            assignments = [base_count] * n_available
-            for i in range(remainder):
-                assignments[i] += 1
-            # --- End of distribution logic ---
-
-            for i, date in enumerate(available_dates):
-                num_assignments_for_this_date = assignments[i]
-                for _ in range(num_assignments_for_this_date):
-                    result.append({
-                        'Date': date,
-                        'Weekday': day,
-                        'In Time': row['In Time'],
-                        'Out Time': row['Out Time']
-                    })
-
-    result_df = pd.DataFrame(result)
-    result_df.to_csv("output.csv", index=False)
-    print(result_df)
+    # Dates in the range for each weekday, concatenated in weekday_cols order
+    date_strs = all_dates.strftime('%Y/%m/%d').to_numpy()
+    day_names = all_dates.day_name()
+    virtual_dates = [date_strs[day_names == day] for day in weekday_cols]
+    n_dates = np.array([len(dates) for dates in virtual_dates])
+    date_offset = np.cumsum(n_dates) - n_dates
+    virtual_dates = np.concatenate(virtual_dates)
+
+    # One entry per (schedule row, weekday) that needs staff on a weekday present in the range
+    counts = df[weekday_cols].to_numpy().astype(int)
+    rows, days = np.nonzero((counts > 0) & (n_dates > 0))
+    totals = counts[rows, days]
+    n = n_dates[days]
+
+    # --- Uniformly distribute the required count across available dates ---
+    # One slot per available date; the first total % n dates get one extra assignment
+    slot_pair = np.repeat(np.arange(len(rows)), n)
+    slot_pos = np.arange(len(slot_pair)) - np.repeat(np.cumsum(n) - n, n)
+    slot_count = totals[slot_pair] // n[slot_pair] + (slot_pos < totals[slot_pair] % n[slot_pair])
+    # --- End of distribution logic ---
+
+    pick = np.repeat(np.arange(len(slot_pair)), slot_count)
+    pair = slot_pair[pick]
+    result_df = pd.DataFrame({
+        'Date': virtual_dates[date_offset[days[pair]] + slot_pos[pick]],
+        'Weekday': np.array(weekday_cols)[days[pair]],
+        'In Time': df['In Time'].to_numpy()[rows[pair]],
+        'Out Time': df['Out Time'].to_numpy()[rows[pair]]
+    })
     return result_df
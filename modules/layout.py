@@ -20,3 +20,25 @@ def set_fullwidth():
       }
     </style>
     """, unsafe_allow_html=True)
+
+# Built once at import; every analysis page re-emits it on each rerun, since Streamlit
+# drops any element a rerun does not write again
+_COMPACT_EXPANDER_CSS = """
+<style>
+  /* Limit expander maximum width */
+  div[data-testid="stExpander"] {
+    max-width: 100px;
+  }
+  /* Reduce padding inside the expander header */
+  div[role="button"][aria-expanded] {
+    padding: 0.25rem 0.5rem;
+  }
+  /* Reduce padding inside the expander content */
+  div[data-testid="stExpander"] > div {
+    padding: 0.5rem;
+  }
+</style>
+"""
+
+def set_compact_expanders():
+    st.markdown(_COMPACT_EXPANDER_CSS, unsafe_allow_html=True)
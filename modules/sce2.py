@@ -1,13 +1,10 @@
-import polars as pl
-import seaborn as sns
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
 import streamlit as st
 import plotly.express as px
-import io
-import matplotlib
-import pandas as pd
-from modules.function import _parse_time_series
+from modules.function import _prepare_crna_data
+from modules.layout import set_compact_expanders
+from modules.function import _figure_png
+from modules.function import _hour_csv_bytes
+from modules.function import _frame_csv_bytes
 from modules.function import _compute_presence_matrix
 from modules.function import _compute_monthly_summary
 from modules.function import _weekday_total_summary
@@ -17,67 +14,52 @@ from modules.function import _compute_normalized_heatmap
 
 _WEEKDAY_ORDER = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
 
+# Figure styling that does not depend on user input, built once at import
+_PIE_LAYOUT = dict(
+    legend=dict(
+        orientation="h",
+        x=0.5, xanchor="center",
+        y=-0.1, yanchor="top"
+    ),
+    template="plotly_white",
+    margin=dict(t=50, l=20, r=20, b=50),
+    height=450
+)
+
 
 def month_analysis():
     """Main function for monthly analysis visualization."""
     # Apply custom CSS
-    st.markdown(
-        """
-        <style>
-        div[data-testid="stExpander"] {
-            max-width: 100px;
-        }
-        div[role="button"][aria-expanded] {
-            padding: 0.25rem 0.5rem;
-        }
-        div[data-testid="stExpander"] > div {
-            padding: 0.5rem;
-        }
-        </style>
-        """,
-        unsafe_allow_html=True
-    )
+    set_compact_expanders()
 
     # Check if data exists
     if 'crna_data' not in st.session_state:
         st.info("Please upload a file to begin.")
         return
 
-    # Initialize DataFrame
-    df = st.session_state['crna_data']
-    
-    # Convert pandas DataFrame to polars if needed
-    if isinstance(df, pd.DataFrame):
-        df = pl.from_pandas(df)
-    df = df.clone()
-    
-    # Standardize Date column
-    df = df.with_columns([
-        pl.col('Date')
-            .cast(pl.String)
-            .str.strptime(pl.Date, format='%Y/%m/%d')
-            .alias('Date')
-    ])
-    
-    # Add weekday column
-    df = df.with_columns([
-        pl.col('Date').dt.strftime('%A').alias('weekday')
-    ])
+    # Parsed once per upload and shared read-only across pages
+    crna_key = st.session_state['crna_key']
+    df = _prepare_crna_data(st.session_state['crna_data'], crna_key)
 
     # —— 2. Monthly summary (with cache + spinner) —— #
     with st.spinner("Calculating monthly summary…"):
-        monthly_summary = _compute_monthly_summary(df)
+        monthly_summary = _compute_monthly_summary(df, crna_key)
+
+    # —— 3. Compute Presence matrix (with cache + spinner) —— #
+    with st.spinner("Computing presence matrix, may take a few seconds…"):
+        output = _compute_presence_matrix(df, crna_key)
 
     # Handle title for pie chart (only initialize once)
     title1 = st.text_input("Pie Chart Title", "Number of Record for Month", key="title1")
 
-    # Create pie chart
+    # Create pie chart; the summary is already sorted by month, so its labels give the order
+    monthly_pd = monthly_summary.to_pandas()
     fig1 = px.pie(
-        monthly_summary.to_pandas(),
+        monthly_pd,
         values='Count',
         names='MonthLabel',
         hole=0.3,
-        category_orders={"MonthLabel": monthly_summary.get_column('MonthLabel').to_list()},
+        category_orders={"MonthLabel": monthly_pd['MonthLabel'].tolist()},
         labels={'MonthLabel': 'Month', 'Count': 'Demand'},
         custom_data=['Count']
     )
@@ -90,27 +72,18 @@ def month_analysis():
     )
     
     fig1.update_layout(
-        legend=dict(
-            orientation="h",
-            x=0.5, xanchor="center",
-            y=-0.1, yanchor="top"
-        ),
-        template="plotly_white",
-        title={"text": title1, "x": 0.5, "xanchor": "center"},
-        margin=dict(t=50, l=20, r=20, b=50),
-        height=450
+        **_PIE_LAYOUT,
+        title={"text": title1, "x": 0.5, "xanchor": "center"}
     )
 
-    # —— 3. Compute Presence matrix (with cache + spinner) —— #
-    with st.spinner("Computing presence matrix, may take a few seconds…"):
-        output = _compute_presence_matrix(df)
-    start_date = output.get_column('Date').min().strftime('%Y-%m-%d')
-    end_date = output.get_column('Date').max().strftime('%Y-%m-%d')
+    start_date = output.get_column('Date').min()
+    end_date = output.get_column('Date').max()
     # —— 4. Aggregate 'Total' by weekday (with cache + spinner) —— #
     with st.spinner("Aggregating total demand by weekday…"):
-        df2 = _weekday_total_summary(output, start_date, end_date)
+        df2_pl = _weekday_total_summary(output, start_date, end_date)
 
-    df2 = df2.to_pandas().set_index('weekday').reindex(_WEEKDAY_ORDER).reset_index()
+    # Already one row per weekday, Sunday..Saturday, so no reindex
+    df2 = df2_pl.to_pandas()
 
     title2 = st.text_input("Bar Chart Title", "Average Hour Demand by Weekday ", key="title2")
 
@@ -122,12 +95,10 @@ def month_analysis():
         text='Total',
         template='plotly_white'
     )
-    single_color = px.colors.qualitative.Plotly[0]
-    fig2.update_traces(marker_color=single_color)
+    fig2.update_traces(marker_color=px.colors.qualitative.Plotly[0], texttemplate='%{text:.0f}')
     fig2.update_layout(
         title={'text': title2, 'x': 0.5, 'xanchor': 'center'}
     )
-    fig2.update_traces(texttemplate='%{text:.0f}')
 
     # —— 5. Normalized heatmap (with cache + spinner) —— #
     # Use the actual data range for start_date/end_date
@@ -138,63 +109,36 @@ def month_analysis():
 
     title3 = st.text_input("Heatmap Title", "Normalized Demand Heatmap", key="title3")
 
-    #theme_mode = st.sidebar.radio("Theme", ["Light", "Dark"])
-    #is_dark = (theme_mode == "Dark")
-    
-    bg_color = st.get_option("theme.backgroundColor")
-    is_dark = (bg_color is not None and bg_color.lower() == "#0f1117")
-
-    fig3, ax = plt.subplots(figsize=(20, 5))
-    df_plot = agg_df.to_pandas().set_index('weekday').reindex(_WEEKDAY_ORDER)
-    if is_dark:
-        fig3.patch.set_facecolor("#0f1117")
-        ax.set_facecolor("#0f1117")
-        cbar_kws = {"format": "%d", "shrink": 0.98}
-        hm = sns.heatmap(df_plot, annot=True, fmt=".2f", linewidths=0.5, cmap='RdYlGn_r', ax=ax, cbar_kws=cbar_kws)
-        # 设置所有文本为白色
-        ax.set_title(
-            title3,
-            fontdict={'fontsize': 18, 'fontweight': 'bold', 'color': 'white'},
-            loc='center',
-            pad=20
-        )
-        ax.set_ylabel("DOW", fontsize=14, color="white")
-        ax.tick_params(axis='x', colors='white')
-        ax.tick_params(axis='y', colors='white')
-        # 设置annot文本为白色
-        for t in hm.texts:
-            t.set_color("white")
-        # 设置colorbar刻度和label为白色
-        cbar = hm.collections[0].colorbar
-        cbar.ax.yaxis.set_tick_params(color='white')
-        plt.setp(cbar.ax.yaxis.get_ticklabels(), color='white')
-        cbar.set_label(cbar.ax.get_ylabel(), color='white')
-        cbar.ax.yaxis.label.set_color('white')
-    else:
-        hm = sns.heatmap(df_plot, annot=True, fmt=".2f", linewidths=0.5, cmap='RdYlGn_r', ax=ax)
-        ax.set_title(
-            title3,
-            fontdict={'fontsize': 18, 'fontweight': 'bold'},
-            loc='center',
-            pad=20
-        )
-        ax.set_ylabel("DOW", fontsize=14)
-    plt.tight_layout()
+    # Plot straight from the Polars frame: its rows are already Sunday..Saturday
+    fig3 = px.imshow(
+        agg_df.drop('weekday').to_numpy(),
+        x=agg_df.columns[1:],
+        y=_WEEKDAY_ORDER,
+        text_auto='.2f',
+        color_continuous_scale='RdYlGn_r',
+        aspect='auto',
+        labels={'x': 'Hour', 'y': 'DOW', 'color': ''}
+    )
+    fig3.update_traces(xgap=1, ygap=1)
+    fig3.update_layout(
+        title={'text': title3, 'x': 0.5, 'xanchor': 'center', 'font': {'size': 18}},
+        height=450
+    )
 
     # —— 6. Display pie chart + bar chart in one row —— #
     col1, col2 = st.columns([1, 2])
     with col1:
         st.plotly_chart(fig1, use_container_width=True)
         with st.expander("💾 Save ", expanded=False):
-            buf1 = io.BytesIO()
-            fig1.write_image(buf1, format="png", scale=2)
-            st.download_button(
-                label="🏞️ PNG",
-                data=buf1.getvalue(),
-                file_name=f"{title1}.png",
-                mime="image/png"
-            )
-            csv1 = monthly_summary.write_csv().encode("utf-8")
+            # Rendering the PNG is slow, so only do it once asked for
+            if st.checkbox("Prepare PNG", key="sce2_png1"):
+                st.download_button(
+                    label="🏞️ PNG",
+                    data=_figure_png(fig1.to_json()),
+                    file_name=f"{title1}.png",
+                    mime="image/png"
+                )
+            csv1 = _frame_csv_bytes(monthly_summary)
             st.download_button(
                 label="📥 CSV",
                 data=csv1,
@@ -204,15 +148,15 @@ def month_analysis():
     with col2:
         st.plotly_chart(fig2, use_container_width=True)
         with st.expander("💾 Save ", expanded=False):
-            buf2 = io.BytesIO()
-            fig2.write_image(buf2, format="png", scale=2)
-            st.download_button(
-                label="🏞️ PNG",
-                data=buf2.getvalue(),
-                file_name=f"{title2}.png",
-                mime="image/png"
-            )
-            csv2 = df2.to_csv(index=False).encode("utf-8")
+            # Rendering the PNG is slow, so only do it once asked for
+            if st.checkbox("Prepare PNG", key="sce2_png2"):
+                st.download_button(
+                    label="🏞️ PNG",
+                    data=_figure_png(fig2.to_json()),
+                    file_name=f"{title2}.png",
+                    mime="image/png"
+                )
+            csv2 = _frame_csv_bytes(df2_pl)
             st.download_button(
                 label="📥 CSV",
                 data=csv2,
@@ -221,19 +165,17 @@ def month_analysis():
             )
 
     # —— 7. Display heatmap in a new row —— #
-    st.pyplot(fig3)
+    st.plotly_chart(fig3, use_container_width=True)
     with st.expander("💾 Save ", expanded=False):
-        buf3 = io.BytesIO()
-        fig3.savefig(buf3, format="png", dpi=150, bbox_inches="tight")
-        st.download_button(
-            label="🏞️ PNG",
-            data=buf3.getvalue(),
-            file_name=f"{title3}.png",
-            mime="image/png"
-        )
-        flattened_data = df_plot.values.flatten(order='C')
-        df_transformed = pd.DataFrame(flattened_data)
-        csv3 = df_transformed.to_csv(index=False, header=['Demand']).encode("utf-8")
+        # Rendering the PNG is slow, so only do it once asked for
+        if st.checkbox("Prepare PNG", key="sce2_png3"):
+            st.download_button(
+                label="🏞️ PNG",
+                data=_figure_png(fig3.to_json()),
+                file_name=f"{title3}.png",
+                mime="image/png"
+            )
+        csv3 = _hour_csv_bytes(agg_df, 'Demand')
         st.download_button(
             label="📥 CSV",
             data=csv3,
@@ -248,6 +190,7 @@ def month_analysis():
             # Clear all related session_state keys
             keys_to_remove = [
                 "crna_data",
+                "crna_key",
                 "analysis_type",
                 "analysis_view",
                 "col_error",
@@ -1,15 +1,12 @@
-import polars as pl
-import seaborn as sns
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
+from datetime import datetime
 import streamlit as st
 import plotly.express as px
-import io
-import matplotlib
-import pandas as pd
-from modules.function import _parse_time_series
+from modules.function import _prepare_crna_data
+from modules.layout import set_compact_expanders
+from modules.function import _figure_png
+from modules.function import _hour_csv_bytes
+from modules.function import _frame_csv_bytes
 from modules.function import _compute_presence_matrix
-from modules.function import _compute_monthly_summary
 from modules.function import _weekday_total_summary_capacity
 from modules.function import _compute_normalized_heatmap
 
@@ -21,75 +18,39 @@ _WEEKDAY_ORDER = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Frida
 def month_capacity_analysis():
     """Main function for monthly analysis visualization."""
     # Apply custom CSS
-    st.markdown(
-        """
-        <style>
-        div[data-testid="stExpander"] {
-            max-width: 100px;
-        }
-        div[role="button"][aria-expanded] {
-            padding: 0.25rem 0.5rem;
-        }
-        div[data-testid="stExpander"] > div {
-            padding: 0.5rem;
-        }
-        </style>
-        """,
-        unsafe_allow_html=True
-    )
+    set_compact_expanders()
 
     # Check if data exists
     if 'crna_data' not in st.session_state:
         st.info("Please upload a file to begin.")
         return
 
-    # Initialize DataFrame
-    df = st.session_state['crna_data']
-    
-    # Convert pandas DataFrame to polars if needed
-    if isinstance(df, pd.DataFrame):
-        df = pl.from_pandas(df)
-    df = df.clone()
-    
-    # The 'Date' column is already in a proper datetime format from the upload step.
-    # No need to standardize it again. We just need to ensure it's a Polars Date type
-    # if it's not already.
-    if df.schema['Date'] != pl.Date:
-        df = df.with_columns(pl.col('Date').cast(pl.Date))
-    
-    # Add weekday column
-    df = df.with_columns([
-        pl.col('Date').dt.strftime('%A').alias('weekday')
-    ])
-
-    # —— 2. Monthly summary (with cache + spinner) —— #
-    with st.spinner("Calculating monthly summary…"):
-        monthly_summary = _compute_monthly_summary(df)
+    # Parsed once per upload and shared read-only across pages
+    crna_key = st.session_state['crna_key']
+    df = _prepare_crna_data(st.session_state['crna_data'], crna_key)
 
     # —— 3. Compute Presence matrix (with cache + spinner) —— #
     with st.spinner("Computing presence matrix, may take a few seconds…"):
-        output = _compute_presence_matrix(df)
+        output = _compute_presence_matrix(df, crna_key)
         
     start_date_str_slash = st.session_state.get('start_date_str')
     end_date_str_slash = st.session_state.get('end_date_str')
 
     if start_date_str_slash and end_date_str_slash:
-        # Convert from YYYY/MM/DD to YYYY-MM-DD for downstream functions
-        start_date = datetime.strptime(start_date_str_slash, '%Y/%m/%d').strftime('%Y-%m-%d')
-        end_date = datetime.strptime(end_date_str_slash, '%Y/%m/%d').strftime('%Y-%m-%d')
+        # Convert from YYYY/MM/DD to dates for downstream functions
+        start_date = datetime.strptime(start_date_str_slash, '%Y/%m/%d').date()
+        end_date = datetime.strptime(end_date_str_slash, '%Y/%m/%d').date()
     else:
         # Fallback if dates are not in session state
-        start_date = output.get_column('Date').min().strftime('%Y-%m-%d')
-        end_date = output.get_column('Date').max().strftime('%Y-%m-%d')
+        start_date = output.get_column('Date').min()
+        end_date = output.get_column('Date').max()
     # --- End of date handling ---
-    print(start_date)
-    print(end_date)
-    # --- End of using selected dates ---
     # —— 4. Aggregate 'Total' by weekday (with cache + spinner) —— #
     with st.spinner("Aggregating total demand by weekday…"):
-        df2 = _weekday_total_summary_capacity(output, start_date, end_date)
+        df2_pl = _weekday_total_summary_capacity(output, start_date, end_date)
 
-    df2 = df2.to_pandas().set_index('weekday').reindex(_WEEKDAY_ORDER).reset_index()
+    # Already one row per weekday, Sunday..Saturday, so no reindex
+    df2 = df2_pl.to_pandas()
 
     title2 = st.text_input("Bar Chart Title", "Average Hour Demand by Weekday ", key="title2")
 
@@ -101,12 +62,10 @@ def month_capacity_analysis():
         text='Total',
         template='plotly_white'
     )
-    single_color = px.colors.qualitative.Plotly[0]
-    fig2.update_traces(marker_color=single_color)
+    fig2.update_traces(marker_color=px.colors.qualitative.Plotly[0], texttemplate='%{text:.0f}')
     fig2.update_layout(
         title={'text': title2, 'x': 0.5, 'xanchor': 'center'}
     )
-    fig2.update_traces(texttemplate='%{text:.0f}')
 
     # —— 5. Normalized heatmap (with cache + spinner) —— #
     with st.spinner("Calculating normalized heatmap data…"):
@@ -114,55 +73,34 @@ def month_capacity_analysis():
 
     title3 = st.text_input("Heatmap Title", "Normalized Demand Heatmap", key="title3")
 
-    bg_color = st.get_option("theme.backgroundColor")
-    is_dark = (bg_color is not None and bg_color.lower() == "#0f1117")
-
-    fig3, ax = plt.subplots(figsize=(20, 5))
-    df_plot = agg_df.to_pandas().set_index('weekday').reindex(_WEEKDAY_ORDER)
-    if is_dark:
-        fig3.patch.set_facecolor("#0f1117")
-        ax.set_facecolor("#0f1117")
-        cbar_kws = {"format": "%d", "shrink": 0.98}
-        hm = sns.heatmap(df_plot, annot=True, fmt=".2f", linewidths=0.5, cmap='RdYlGn_r', ax=ax, cbar_kws=cbar_kws)
-        ax.set_title(
-            title3,
-            fontdict={'fontsize': 18, 'fontweight': 'bold', 'color': 'white'},
-            loc='center',
-            pad=20
-        )
-        ax.set_ylabel("DOW", fontsize=14, color="white")
-        ax.tick_params(axis='x', colors='white')
-        ax.tick_params(axis='y', colors='white')
-        for t in hm.texts:
-            t.set_color("white")
-        cbar = hm.collections[0].colorbar
-        cbar.ax.yaxis.set_tick_params(color='white')
-        plt.setp(cbar.ax.yaxis.get_ticklabels(), color='white')
-        cbar.set_label(cbar.ax.get_ylabel(), color='white')
-        cbar.ax.yaxis.label.set_color('white')
-    else:
-        hm = sns.heatmap(df_plot, annot=True, fmt=".2f", linewidths=0.5, cmap='RdYlGn_r', ax=ax)
-        ax.set_title(
-            title3,
-            fontdict={'fontsize': 18, 'fontweight': 'bold'},
-            loc='center',
-            pad=20
-        )
-        ax.set_ylabel("DOW", fontsize=14)
-    plt.tight_layout()
+    # Plot straight from the Polars frame: its rows are already Sunday..Saturday
+    fig3 = px.imshow(
+        agg_df.drop('weekday').to_numpy(),
+        x=agg_df.columns[1:],
+        y=_WEEKDAY_ORDER,
+        text_auto='.2f',
+        color_continuous_scale='RdYlGn_r',
+        aspect='auto',
+        labels={'x': 'Hour', 'y': 'DOW', 'color': ''}
+    )
+    fig3.update_traces(xgap=1, ygap=1)
+    fig3.update_layout(
+        title={'text': title3, 'x': 0.5, 'xanchor': 'center', 'font': {'size': 18}},
+        height=450
+    )
 
     # —— Display bar chart (fig2) —— #
     st.plotly_chart(fig2, use_container_width=True)
     with st.expander("💾 Save Bar Chart", expanded=False):
-        buf2 = io.BytesIO()
-        fig2.write_image(buf2, format="png", scale=2)
-        st.download_button(
-            label="🏞️ PNG",
-            data=buf2.getvalue(),
-            file_name=f"{title2}.png",
-            mime="image/png"
-        )
-        csv2 = df2.to_csv(index=False).encode("utf-8")
+        # Rendering the PNG is slow, so only do it once asked for
+        if st.checkbox("Prepare PNG", key="sce2_capacity_png2"):
+            st.download_button(
+                label="🏞️ PNG",
+                data=_figure_png(fig2.to_json()),
+                file_name=f"{title2}.png",
+                mime="image/png"
+            )
+        csv2 = _frame_csv_bytes(df2_pl)
         st.download_button(
             label="📥 CSV",
             data=csv2,
@@ -171,19 +109,17 @@ def month_capacity_analysis():
         )
 
     # —— Display heatmap (fig3) —— #
-    st.pyplot(fig3)
+    st.plotly_chart(fig3, use_container_width=True)
     with st.expander("💾 Save Heatmap", expanded=False):
-        buf3 = io.BytesIO()
-        fig3.savefig(buf3, format="png", dpi=150, bbox_inches="tight")
-        st.download_button(
-            label="🏞️ PNG",
-            data=buf3.getvalue(),
-            file_name=f"{title3}.png",
-            mime="image/png"
-        )
-        flattened_data = df_plot.values.flatten(order='C')
-        df_transformed = pd.DataFrame(flattened_data)
-        csv3 = df_transformed.to_csv(index=False, header=['Capacity']).encode("utf-8")
+        # Rendering the PNG is slow, so only do it once asked for
+        if st.checkbox("Prepare PNG", key="sce2_capacity_png3"):
+            st.download_button(
+                label="🏞️ PNG",
+                data=_figure_png(fig3.to_json()),
+                file_name=f"{title3}.png",
+                mime="image/png"
+            )
+        csv3 = _hour_csv_bytes(agg_df, 'Capacity')
         st.download_button(
             label="📥 CSV",
             data=csv3,
@@ -198,6 +134,7 @@ def month_capacity_analysis():
             # Clear all related session_state keys
             keys_to_remove = [
                 "crna_data",
+                "crna_key",
                 "analysis_type",
                 "analysis_view",
                 "col_error",
@@ -1,16 +1,10 @@
-import polars as pl
-import pandas as _pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
 import streamlit as st
 import plotly.express as px
-import io
-import numpy as np
-import pandas as pd
-from modules.function import _parse_time_series
+from modules.function import _prepare_crna_data
+from modules.layout import set_compact_expanders
+from modules.function import _figure_png
+from modules.function import _hour_csv_bytes
 from modules.function import _compute_monthly_summary
-from modules.function import _weekday_total_summary
 from modules.function import _compute_normalized_heatmap
 from modules.function import _compute_duration_matrix
 
@@ -22,58 +16,20 @@ _WEEKDAY_ORDER = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Frida
 def duration_month_analysis():
     """Main function for monthly analysis visualization."""
     # Apply custom CSS
-    st.markdown(
-        """
-        <style>
-        div[data-testid="stExpander"] {
-            max-width: 100px;
-        }
-        div[role="button"][aria-expanded] {
-            padding: 0.25rem 0.5rem;
-        }
-        div[data-testid="stExpander"] > div {
-            padding: 0.5rem;
-        }
-        </style>
-        """,
-        unsafe_allow_html=True
-    )
+    set_compact_expanders()
 
     # Check if data exists
     if 'crna_data' not in st.session_state:
         st.info("Please upload a file to begin.")
         return
 
-    # Initialize DataFrame
-    df = st.session_state['crna_data']
-    
-    # Convert pandas DataFrame to polars if needed
-    if isinstance(df, _pd.DataFrame):
-        df = pl.from_pandas(df)
-    df = df.clone()
-    
-    # Standardize Date column
-    df = df.with_columns([
-        # First standardize the format by replacing all separators with '/'
-        pl.col('Date').str.replace_all(r'[-.]', '/').alias('Date')
-    ]).with_columns([
-        # Then try both date formats with strict=False
-        pl.when(pl.col('Date').str.strptime(pl.Date, format='%Y/%m/%d', strict=False).is_not_null())
-            .then(pl.col('Date').str.strptime(pl.Date, format='%Y/%m/%d', strict=False))
-            .otherwise(
-                pl.col('Date').str.strptime(pl.Date, format='%m/%d/%Y', strict=False)
-            )
-            .alias('Date')
-    ])
-    
-    # Add weekday column
-    df = df.with_columns([
-        pl.col('Date').dt.strftime('%A').alias('weekday')
-    ])
+    # Parsed once per upload and shared read-only across pages
+    crna_key = st.session_state['crna_key']
+    df = _prepare_crna_data(st.session_state['crna_data'], crna_key)
 
     # —— 2. Monthly summary (with cache + spinner) —— #
     with st.spinner("Calculating monthly summary…"):
-        monthly_summary = _compute_monthly_summary(df)
+        monthly_summary = _compute_monthly_summary(df, crna_key)
 
     # Handle title for pie chart (only initialize once)
     #title1 = st.text_input("Pie Chart Title", "Number of Record for Month", key="title1")
@@ -110,12 +66,12 @@ def duration_month_analysis():
 
     # —— 3. Compute Duration matrix (with cache + spinner) —— #
     with st.spinner("Computing duration matrix, may take a few seconds…"):
-        output = _compute_duration_matrix(df)
+        output = _compute_duration_matrix(df, crna_key)
 
     # —— 4. Aggregate 'Total' by weekday (with cache + spinner) —— #
     # with st.spinner("Aggregating total duration by weekday…"):
-    #     start_date = output.get_column('Date').min().strftime('%Y-%m-%d')
-    #     end_date = output.get_column('Date').max().strftime('%Y-%m-%d')
+    #     start_date = output.get_column('Date').min()
+    #     end_date = output.get_column('Date').max()
     #     df2 = _weekday_total_summary(output, start_date, end_date)
 
     # df2_plot = df2.to_pandas().set_index('weekday').reindex(_WEEKDAY_ORDER).reset_index()
@@ -136,25 +92,29 @@ def duration_month_analysis():
 
     # —— 5. Normalized heatmap (with cache + spinner) —— #
     # Use the actual data range for start_date/end_date
-    start_date = output.get_column('Date').min().strftime('%Y-%m-%d')
-    end_date = output.get_column('Date').max().strftime('%Y-%m-%d')
+    start_date = output.get_column('Date').min()
+    end_date = output.get_column('Date').max()
     
     with st.spinner("Calculating normalized heatmap data…"):
         agg_df = _compute_normalized_heatmap(output, start_date, end_date)
 
-    df_plot = agg_df.to_pandas().set_index('weekday').reindex(_WEEKDAY_ORDER)
+    # Plot straight from the Polars frame: its rows are already Sunday..Saturday
     title3 = st.text_input("Heatmap Title", "Normalized Duration Heatmap", key="title3")
 
-    fig3, ax = plt.subplots(figsize=(20, 5))
-    sns.heatmap(df_plot, annot=True, fmt=".2f", linewidths=0.5, cmap='RdYlGn_r', ax=ax)
-    ax.set_title(
-        title3,
-        fontdict={'fontsize': 18, 'fontweight': 'bold'},
-        loc='center',
-        pad=20
+    fig3 = px.imshow(
+        agg_df.drop('weekday').to_numpy(),
+        x=agg_df.columns[1:],
+        y=_WEEKDAY_ORDER,
+        text_auto='.2f',
+        color_continuous_scale='RdYlGn_r',
+        aspect='auto',
+        labels={'x': 'Hour', 'y': 'DOW', 'color': ''}
+    )
+    fig3.update_traces(xgap=1, ygap=1)
+    fig3.update_layout(
+        title={'text': title3, 'x': 0.5, 'xanchor': 'center', 'font': {'size': 18}},
+        height=450
     )
-    ax.set_ylabel("DOW", fontsize=14)
-    plt.tight_layout()
 
     # —— 6. Display pie chart + bar chart in one row —— #
     # col1, col2 = st.columns([1, 2])
@@ -196,19 +156,17 @@ def duration_month_analysis():
     #         )
 
     # —— 7. Display heatmap in a new row —— #
-    st.pyplot(fig3)
+    st.plotly_chart(fig3, use_container_width=True)
     with st.expander("💾 Save ", expanded=False):
-        buf3 = io.BytesIO()
-        fig3.savefig(buf3, format="png", dpi=150, bbox_inches="tight")
-        st.download_button(
-            label="🏞️ PNG",
-            data=buf3.getvalue(),
-            file_name=f"{title3}.png",
-            mime="image/png"
-        )
-        flattened_data = df_plot.values.flatten(order='C')
-        df_transformed = pd.DataFrame(flattened_data)
-        csv3 = df_transformed.to_csv(index=False, header=['Demand']).encode("utf-8")
+        # Rendering the PNG is slow, so only do it once asked for
+        if st.checkbox("Prepare PNG", key="sce4_png3"):
+            st.download_button(
+                label="🏞️ PNG",
+                data=_figure_png(fig3.to_json()),
+                file_name=f"{title3}.png",
+                mime="image/png"
+            )
+        csv3 = _hour_csv_bytes(agg_df, 'Demand')
         st.download_button(
             label="📥 CSV",
             data=csv3,
@@ -223,6 +181,7 @@ def duration_month_analysis():
             # Clear all related session_state keys
             keys_to_remove = [
                 "crna_data",
+                "crna_key",
                 "analysis_type",
                 "analysis_view",
                 "col_error",
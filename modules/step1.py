@@ -2,6 +2,7 @@ import polars as pl
 from datetime import datetime, timedelta
 import streamlit as st
 from modules.layout import set_narrow
+from modules.function import _frame_hash
 
 import pandas as pd
 
@@ -246,6 +247,8 @@ def uploadstep1_page():
 
         # Store polars DataFrame directly without converting to pandas
         st.session_state["crna_data"] = df2
+        # Hashed once here; the analysis pages key their caches on it instead of rehashing the frame
+        st.session_state["crna_key"] = _frame_hash(df2)
 
         if total_errors > 0:
             st.markdown("### 📊 Error Statistics Summary")
@@ -338,6 +341,7 @@ def uploadstep1_page():
 
             keys_to_remove = [
                 "crna_data",
+                "crna_key",
                 "analysis_type",
                 "analysis_view",
                 "col_error",
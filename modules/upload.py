@@ -1,14 +1,10 @@
 import streamlit as st
-import pandas as pd
 import polars as pl
-import seaborn as sns
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
-import streamlit as st
-import plotly.express as px 
+from datetime import datetime
 from pathlib import Path
-from modules.layout import set_narrow,set_fullwidth
+from modules.layout import set_narrow
 from modules.function import process_schedule_excel
+from modules.function import _frame_hash
 def render_upload_page():
     set_narrow(800)
     ROOT = Path(__file__).resolve().parents[1]
@@ -64,47 +60,40 @@ def render_upload_page():
         uploaded = st.session_state.get("uploaded_file_for_capacity")
 
         if uploaded:
-            import tempfile
-            import os
-
-            suffix = Path(uploaded.name).suffix
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-                tmp_file.write(uploaded.getbuffer())
-                tmp_path = tmp_file.name
-
-            # process_schedule_excel returns a pandas DataFrame
+            # process_schedule_excel reads the upload's bytes directly, no temp file needed
             result_df_pd = process_schedule_excel(
-                tmp_path,
+                uploaded,
                 start_date_str=processing_info["start_date"],
                 end_date_str=processing_info["end_date"]
             )
-            
-            # --- Auto-select columns and prepare for analysis ---
-            # Keep only the necessary columns and rename them for consistency
-            final_df_pd = result_df_pd[['Date', 'In Time', 'Out Time']].copy()
-            final_df_pd.rename(columns={'In Time': 'In Room', 'Out Time': 'Out Room'}, inplace=True)
 
-            # Add a 'Count' column, defaulting to 1, similar to the demand flow
-            final_df_pd['Count'] = 1
+            # --- Auto-select columns and prepare for analysis ---
+            # Keep only the necessary columns and rename them for consistency;
+            # everything after the one conversion stays in Polars
+            crna_data_pl = (
+                pl.from_pandas(result_df_pd[['Date', 'In Time', 'Out Time']])
+                .rename({'In Time': 'In Room', 'Out Time': 'Out Room'})
+                .with_columns([
+                    pl.col('Date').str.strptime(pl.Date, format='%Y/%m/%d'),
+                    # Add a 'Count' column, defaulting to 1, similar to the demand flow
+                    pl.lit(1, dtype=pl.Int64).alias('Count')
+                ])
+            )
             # --- End of auto-selection ---
-            
+
             # --- Calculate total months for normalization ---
-            if not final_df_pd.empty:
-                # Ensure 'Date' column is in datetime format
-                final_df_pd['Date'] = pd.to_datetime(final_df_pd['Date'])
-                # Calculate the number of unique months
-                total_months = final_df_pd['Date'].dt.to_period('M').nunique()
+            if crna_data_pl.height > 0:
+                total_months = crna_data_pl.get_column('Date').dt.truncate('1mo').n_unique()
             else:
                 total_months = 1 # Avoid division by zero if dataframe is empty
-            
+
             st.session_state['total_months'] = total_months
             # --- End of total months calculation ---
 
-            # Convert to Polars DataFrame for consistency with other pages
-            crna_data_pl = pl.from_pandas(final_df_pd)
-
             # Set the data and analysis parameters directly for the next page
             st.session_state["crna_data"] = crna_data_pl
+            # Hashed once here; the analysis pages key their caches on it instead of rehashing the frame
+            st.session_state["crna_key"] = _frame_hash(crna_data_pl)
             st.session_state.analysis_type = "presence"
             st.session_state.analysis_view = "month"
             